@@ -1,11 +1,18 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
 from scipy.stats import shapiro,anderson  ##### shapiro not good for large sample size >5k
 from scipy.stats import normaltest #### this is D'Agnostino K2
 from scipy.stats import pointbiserialr,pearsonr,spearmanr,kendalltau
-from scipy.stats import chi2_contingency
+from scipy.special import chdtrc
 import warnings
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Upper bounds of small and medium Cramer's V effect sizes for dof = 1,2,3,>=4
+_EFF_THRESH = np.array([[0.3,0.5],[0.21,0.35],[0.17,0.29],[0.15,0.25]])
+_EFF_LABELS = np.array(["small","medium","large"],dtype=object)
+# Position of each significance level (%) in the critical values returned by scipy's anderson for dist="norm"
+_AD_IDX = {15.0:0,10.0:1,5.0:2,2.5:3,1.0:4}
 
 def normality_test(X,X_name=None,test="dagnostino",alpha=0.05):
     """
@@ -18,7 +25,7 @@ def normality_test(X,X_name=None,test="dagnostino",alpha=0.05):
     X_name: str, default=None
         Name of input variable
     test: {"dagnostino","shapiro","anderson"}, default="dagnostino"
-        shapiro is suitable for smaller datasets <5k data points
+        shapiro is suitable for smaller datasets <5k data points, dagnostino is used instead above 5000 data points
         For anderson-darling test, only a limited set of alpha is accepted. See https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.anderson.html 
         Interpretationof anderson-darling test has a different logic from the other 2. See above link for details although it still shares the same null hypothesis
     alpha: [0,1], default=0.05
@@ -34,7 +41,11 @@ def normality_test(X,X_name=None,test="dagnostino",alpha=0.05):
     """
 
     print("H0: The population is normally distributed")
-    assert ~np.isnan(X).any(), "Input array must contain no NA"
+    # Convert first, Series.sum would skip NA
+    assert np.isfinite(np.asarray(X,dtype=float)).all(), "Input array must contain no NA or infinite values"
+    if test=="shapiro" and len(X) > 5000:
+        warnings.warn("shapiro is not valid for more than 5000 data points, falling back to test=dagnostino.")
+        test = "dagnostino"
     if test=="dagnostino":
         val,p = normaltest(X)
     elif test=="shapiro":
@@ -42,9 +53,10 @@ def normality_test(X,X_name=None,test="dagnostino",alpha=0.05):
     else:
         warnings.warn("if test=anderson, no value is returned. Interpretation of result is different from shapiro and d'agnostino.")
         val_stat,cri_list,sig_list=anderson(X)
-        assert alpha*100 in sig_list, f"alpha must be in {sig_list/100} for test=anderson"
+        sig = round(alpha*100,1)
+        assert sig in _AD_IDX, f"alpha must be in {sig_list/100} for test=anderson"
         # For anderson-darling, if val_stat > critical_val at a particular significance => Reject H0, different from the other 2 tests
-        p = cri_list[np.where(sig_list==alpha*100)]
+        p = cri_list[_AD_IDX[sig]]
         alpha = val_stat # Semantics of anderson-darling is different from the other 2 tests, flip these 2 values for coding consistency
 
     if p<= alpha:
@@ -114,7 +126,7 @@ def correlation(X0,X1,X_name=None,test="pearson",alpha=0.05,print_result=True):
 
 
 
-def cramers_v(X0,X1,X_name=None,alpha=0.05,print_result=True):
+def cramers_v(X0,X1,X_name=None,alpha=0.05,print_result=True,return_effect=True):
     """
     Calculate association degrees between 2 categorical variables
     
@@ -124,58 +136,39 @@ def cramers_v(X0,X1,X_name=None,alpha=0.05,print_result=True):
     X_name: list of 2 strings
     alpha: float [0,1], default=0.05
         Thereshold significance value 
+    print_result: bool, default=True
+        If True, contingency table and result of test are printed
+    return_effect: bool, default=True
+        If False and print_result=False, the effect size is not classified and None is returned in its place
     
     Returns:
     -------
     v: statistic test
     p: p-value
+    eff_size: {"small","medium","large"}, NaN if not significant
     """
-    crosstab = pd.crosstab(X0,X1)
-    chitest, p, dof, expected = chi2_contingency(crosstab)
-    n = crosstab.sum().sum()
-    dof0 = min(crosstab.shape) - 1
-    v = np.sqrt(chitest/(n*dof0))
+    # Integer codes, same table layout as pd.crosstab without the DataFrame overhead
+    c0,u0 = pd.factorize(X0,sort=True)
+    c1,u1 = pd.factorize(X1,sort=True)
+    keep = (c0>=0) & (c1>=0)
+    if not keep.all():
+        # NA gets code -1, drop those pairs like pd.crosstab along with categories only seen next to NA
+        c0,u0 = pd.factorize(np.asarray(X0)[keep],sort=True)
+        c1,u1 = pd.factorize(np.asarray(X1)[keep],sort=True)
+    r,k = len(u0),len(u1)
+    v,p,dof = _cramers_core(c0,c1,r,k)
+    dof0 = min(r,k) - 1
+    if not (print_result or return_effect):
+        return v,p,None
     eff_size=np.nan
+    if print_result:
+        crosstab = np.bincount(c0*k + c1,minlength=r*k).reshape(r,k)
+        print(pd.DataFrame(crosstab,index=pd.Index(u0,name="row_0"),columns=pd.Index(u1,name="col_0")))
 
     # Interpretation of results
     if p <= alpha:
-        if dof0 == 1:
-            if v <0.3:
-                eff_size ="small"
-            elif v<0.5:
-                eff_size = "medium"
-            else:
-                eff_size = "large"
-        elif dof0 == 2:
-            if v <0.21:
-                eff_size ="small"
-            elif v<0.35:
-                eff_size = "medium"
-            else:
-                eff_size = "large"
-        elif dof0 == 3:
-            if v <0.17:
-                eff_size ="small"
-            elif v<0.29:
-                eff_size = "medium"
-            else:
-                eff_size = "large"
-        elif dof0 == 4:
-            if v <0.15:
-                eff_size ="small"
-            elif v<0.25:
-                eff_size = "medium"
-            else:
-                eff_size = "large"
-        else:
-            if v <0.15:
-                eff_size ="small"
-            elif v<0.25:
-                eff_size = "medium"
-            else:
-                eff_size = "large"
+        eff_size = _effect_size(np.array([v]),np.array([dof0]))[0]
         if print_result:
-            print(crosstab)
             if X_name:
                 print(f"{X_name[0]} is dependent on {X_name[1]} with p = {p:.3f}")
             else:
@@ -183,7 +176,6 @@ def cramers_v(X0,X1,X_name=None,alpha=0.05,print_result=True):
             print(f"With a {eff_size} effect size v = {v:.2f} for dof = {dof0}")
     else:
         if print_result:
-            print(crosstab)
             if X_name:
                 print(f'No association between {X_name[0]} and {X_name[1]}')
             else:
@@ -192,7 +184,76 @@ def cramers_v(X0,X1,X_name=None,alpha=0.05,print_result=True):
 
 
 
-def generate_sym_matrix(df,col,test="pearson",alpha=0.05,threshold=0.05):
+def _effect_size(v,dof0):
+    """
+    Effect size of Cramer's V, vectorized over arrays of v and dof
+    Parameters:
+    ----------
+    v: array of Cramer's V
+    dof0: int array of min(r,k)-1, same shape as v
+
+    Returns:
+    -------
+    eff_size: object array of {"small","medium","large"}
+    """
+    thresh = _EFF_THRESH[np.clip(dof0,1,4) - 1]
+    # Row-wise searchsorted with side="right": number of bounds that v reaches
+    return _EFF_LABELS[(v[...,None] >= thresh).sum(axis=-1)]
+
+
+
+def _chi2_test(observed):
+    """
+    Chi-square test of independence on a contingency table, same result as chi2_contingency
+    without its input validation and options
+    Parameters:
+    ----------
+    observed: 2D array of counts
+
+    Returns:
+    -------
+    chitest: chi-square statistic
+    p: p-value
+    dof: degrees of freedom
+    """
+    observed = np.asarray(observed,dtype=float)
+    n = observed.sum()
+    expected = np.outer(observed.sum(axis=1),observed.sum(axis=0))/n
+    dof = (observed.shape[0]-1)*(observed.shape[1]-1)
+    if dof == 0:
+        return 0.0,1.0,dof
+    if dof == 1:
+        # Yates' correction, as applied by chi2_contingency
+        diff = expected - observed
+        observed = observed + np.sign(diff)*np.minimum(0.5,np.abs(diff))
+    chitest = np.divide((observed - expected)**2,expected,out=np.zeros_like(expected),where=expected>0).sum()
+    p = chdtrc(dof,chitest)
+    return chitest,p,dof
+
+
+
+def _cramers_core(c0,c1,r,k):
+    """
+    Numeric core of cramers_v working on integer codes
+    Parameters:
+    ----------
+    c0,c1: 1D int arrays of codes in [0,r) and [0,k)
+    r,k: int, number of categories of each variable
+
+    Returns:
+    -------
+    v: statistic test
+    p: p-value
+    dof: degrees of freedom of the chi-square test
+    """
+    observed = np.bincount(c0*k + c1,minlength=r*k).reshape(r,k)
+    chitest,p,dof = _chi2_test(observed)
+    v = np.sqrt(chitest/(observed.sum()*(min(r,k) - 1)))
+    return v,p,dof
+
+
+
+def generate_sym_matrix(df,col,test="pearson",alpha=0.05,threshold=0.05,dtype=np.float64,n_jobs=1):
     """
     Generate symmetric matrix of correlation coefficients
     Parameters:
@@ -206,6 +267,11 @@ def generate_sym_matrix(df,col,test="pearson",alpha=0.05,threshold=0.05):
         Threshold of significance
     threshold: float [0,1], default=0.05
         Threshold of % of unique values to be considered categorical
+    dtype: numpy float dtype, default=np.float64
+        dtype of the returned matrix. The heatmap only shows 2 decimals, np.float32 halves memory for many columns
+    n_jobs: int, default=1
+        Number of threads computing the pairs, only used for test="kendall" and ignored for the other tests.
+        Negative values count from the number of cores like joblib: -1 uses all cores, -2 all but one
 
     Returns:
     -------
@@ -213,19 +279,66 @@ def generate_sym_matrix(df,col,test="pearson",alpha=0.05,threshold=0.05):
         Symmetric matrix of coefficient
     hm: axis handle of heatmap plot
     """
-    assert ~(df[col].isna().any(axis=1).any()), "Data contains NA, must be removed before performing tests"
-    df_result = pd.DataFrame()
-    for i in col:
-        for j in col:
+    # seaborn pulls in matplotlib, only pay for the import when plotting
+    import seaborn as sns
+    assert n_jobs != 0, "n_jobs must be a positive int, or negative to count from the number of cores (-1 uses all cores)"
+    if n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs,1)
+    if test!="pearson":
+        # Columns may not be numeric (ordinal or categorical), use the NA mask
+        assert not df[col].isna().to_numpy().any(), "Data contains NA, must be removed before performing tests"
+    if test=="pearson":
+        # Only the coefficients are kept, standardize the columns and get all of them with one matrix product
+        M = df[col].to_numpy(dtype=float)
+        # NaN propagates through the sum, no need for a separate NA mask
+        assert not np.isnan(M.sum()), "Data contains NA, must be removed before performing tests"
+        with np.errstate(divide="ignore",invalid="ignore"):
+            M = (M - M.mean(axis=0))/M.std(axis=0,ddof=1)
+        out = np.clip((M.T @ M)/(len(M) - 1),-1.0,1.0)
+        df_result = pd.DataFrame(out.astype(dtype,copy=False),index=col,columns=col)
+    elif test=="spearman":
+        # Spearman is pearson on average ranks, rank each column once
+        df_result = df[col].rank().corr(method="pearson").astype(dtype,copy=False)
+    else:
+        if test=="cramersv":
+            countval = np.array([df[k].nunique()/df[k].count() for k in col])
+            assert (countval<threshold).all(), "Cramers only works for categorical data. Check input data or increase threshold to bypass categorical data check"
+        n = len(col)
+        out = np.empty((n,n),dtype=dtype)
+        arrs = [df[c].to_numpy() for c in col]
+        if test=="cramersv":
+            # Factorize each column once instead of once per pair
+            codes,cards = [],[]
+            for arr in arrs:
+                c,u = pd.factorize(arr)
+                codes.append(c)
+                cards.append(len(u))
+
+        def pair_kernel(pair):
+            ii,jj = pair
             if test=="cramersv":
-                countval = np.array([df[k].nunique()/df[k].count() for k in col])
-                assert all(countval<threshold), "Cramers only works for categorical data. Check input data or increase threshold to bypass categorical data check"
-                v,p,effect_size = cramers_v(df[i].values,df[j].values,alpha=alpha,print_result=False)
+                v,p,dof = _cramers_core(codes[ii],codes[jj],cards[ii],cards[jj])
             else:
-                v,p = correlation(df[i].values,df[j].values,test=test,alpha=alpha,print_result=False)
+                # kendall and pointbiserial, scipy's compiled per pair routines on the cached arrays
+                v,p = correlation(arrs[ii],arrs[jj],test=test,alpha=alpha,print_result=False)
+            return v
+
+        # Pairs are independent, only the upper triangle is computed
+        pairs = [(ii,jj) for ii in range(n) for jj in range(ii+1,n)]
+        if test=="kendall" and n_jobs > 1:
+            # Threads share the cached arrays without copies. Only kendall's O(n log n) sorts are heavy
+            # enough per pair, cramersv and pointbiserial are small numpy calls mostly holding the GIL
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                values = list(executor.map(pair_kernel,pairs))
+        else:
+            values = map(pair_kernel,pairs)
+        # A variable is perfectly associated with itself, no need to run the test on the diagonal
+        np.fill_diagonal(out,1.0)
+        for (ii,jj),v in zip(pairs,values):
+            # Coefficients are symmetric, mirror the upper triangle
+            out[ii,jj] = out[jj,ii] = v
+        df_result = pd.DataFrame(out,index=col,columns=col)
 
-            df_result.loc[i,j] = v
-            
     hm = sns.heatmap(df_result,cbar=True,annot=True,square=True,fmt=".2f",yticklabels=col,xticklabels=col).set(title =f"{test} test's coefficient")
 
     return df_result,hm